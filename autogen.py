@@ -1,87 +1,277 @@
 import os
+import sys
+import pickle
+import hashlib
 import argparse
 import traceback
+import operator
 import subprocess
-from uuid import uuid4
-from json import dumps
 from copy import deepcopy
-from pprint import pprint
+from functools import lru_cache
+from ast import literal_eval
+from pprint import pformat
 from random import randint
-from typing import Union, Any
-from collections import ChainMap
+from collections import deque
+from contextlib import closing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Union, Any, Iterator, Optional
+from dataclasses import dataclass
 
-from pycparser import c_ast, parse_file
+import pycparser
+from pycparser import c_ast
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from json import dumps as json_dumps
+
+
+def dumps(o: Any) -> str:
+    # orjson is optional, fallback emits same bytes: raw UTF-8 instead of \uXXXX escapes, no spaces
+    if orjson is not None:
+        return orjson.dumps(o).decode('utf-8')
+    else:
+        return json_dumps(o, ensure_ascii=False, separators=(',', ':'))
 
 
 DEFAULT_FRONTEND_CFLAGS = r"-nostdinc -D__attribute__(x) -Ilocal/quickjs-cffi/fake_libc_include -Ilocal/quickjs-cffi/fake_include".split(' ')
 
-QUICKJS_FFI_WRAP_PTR_FUNC_DECL = '''
-const __quickjs_ffi_wrap_ptr_func_decl = (lib, name, nargs, ...types) => {
-    // wrap C function
-    const c_types = types.map(type => {
-        if (typeof type == 'string') {
-            return type;
-        } else if (typeof type == 'object') {
-            if (type.kind == 'PtrDecl') {
-                if (type.type == 'char') {
-                    return 'string';
-                } else {
-                    return 'pointer';
-                }
-            } else if (type.kind == 'PtrFuncDecl') {
-                return 'pointer';
-            } else {
-                throw new Error('Unsupported type');
-            }
-        } else {
-            throw new Error('Unsupported type');
-        }
-    });
+# per-user AST cache, pickles are only loaded from directory owned and accessible by current user only
+AST_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'quickjs-cffi', 'ast')
 
-    let c_func;
+# least recently used entries above this limit are removed after each new entry
+AST_CACHE_MAX_ENTRIES = 256
+
+JS_WRITE_BATCH_SIZE = 1 << 16
+
+# identifiers are repeated across many registries, share one string object per name
+def intern_name(name: Optional[str]) -> Optional[str]:
+    return sys.intern(name) if name else name
+
+
+# C integer division and remainder truncate toward zero
+def c_div(a: int, b: int) -> int:
+    return abs(a) // abs(b) * (1 if (a < 0) == (b < 0) else -1)
+
+
+def c_mod(a: int, b: int) -> int:
+    return a - b * c_div(a, b)
+
+
+def c_not(a: int) -> int:
+    return int(not a)
+
+
+# C comparison and logical operators yield int 1 or 0, not bool
+def c_eq(a: int, b: int) -> int:
+    return int(a == b)
+
+
+def c_ne(a: int, b: int) -> int:
+    return int(a != b)
+
+
+def c_lt(a: int, b: int) -> int:
+    return int(a < b)
 
-    try {
-        c_func = new CFunction(lib, name, nargs, ...c_types);
-    } catch (e) {
-        console.log('Warning:', name, e);
-        c_func = null;
-    }
-    
-    const js_func = (...js_args) => {
-        const c_args = types.slice(1).map((type, i) => {
-            const js_arg = js_args[i];
-
-            if (typeof type == 'string') {
-                return js_arg;
-            } else if (typeof type == 'object') {
-                if (type.kind == 'PtrFuncDecl') {
-                    const c_cb = new CCallback(js_arg, null, ...[type.return_type, ...type.params_types]);
-                    return c_cb.cfuncptr;
-                } else {
-                    return js_arg;
-                }
-            } else {
-                return js_arg;
-            }
-        });
-
-        return c_func.invoke(...c_args);
-    };
-
-    return js_func;
-};
 
-const _quickjs_ffi_wrap_ptr_func_decl = (lib, name, nargs, ...types) => {
+def c_gt(a: int, b: int) -> int:
+    return int(a > b)
+
+
+def c_le(a: int, b: int) -> int:
+    return int(a <= b)
+
+
+def c_ge(a: int, b: int) -> int:
+    return int(a >= b)
+
+
+def c_and(a: int, b: int) -> int:
+    return int(bool(a) and bool(b))
+
+
+def c_or(a: int, b: int) -> int:
+    return int(bool(a) or bool(b))
+
+
+ENUM_BINARY_OPS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': c_div,
+    '%': c_mod,
+    '<<': operator.lshift,
+    '>>': operator.rshift,
+    '&': operator.and_,
+    '|': operator.or_,
+    '^': operator.xor,
+    '==': c_eq,
+    '!=': c_ne,
+    '<': c_lt,
+    '>': c_gt,
+    '<=': c_le,
+    '>=': c_ge,
+    '&&': c_and,
+    '||': c_or,
+}
+
+ENUM_UNARY_OPS = {
+    '+': operator.pos,
+    '-': operator.neg,
+    '~': operator.invert,
+    '!': c_not,
+}
+
+def get_ast_cache_dir() -> Optional[str]:
+    try:
+        os.makedirs(AST_CACHE_DIR, mode=0o700, exist_ok=True)
+        st = os.lstat(AST_CACHE_DIR)
+    except OSError as e:
+        return None
+
+    # refuse directory which other users own or can write to, its pickles could run arbitrary code
+    if not os.path.isdir(AST_CACHE_DIR) or os.path.islink(AST_CACHE_DIR) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        return None
+
+    return AST_CACHE_DIR
+
+
+def prune_ast_cache(cache_dir: str):
+    try:
+        paths = [os.path.join(cache_dir, n) for n in os.listdir(cache_dir) if n.endswith('.pkl')]
+        paths.sort(key=os.path.getmtime, reverse=True)
+
+        for path in paths[AST_CACHE_MAX_ENTRIES:]:
+            os.remove(path)
+    except OSError as e:
+        # entries can disappear under concurrent runs
+        pass
+
+
+# headers repeat the same literals (0, 1, 0x10, ...) across many enumerators
+@lru_cache(maxsize=4096)
+def eval_enum_constant(const_type: str, value: str) -> int:
+    if const_type == 'char':
+        return ord(literal_eval(value))
+
+    # strip integer suffixes such as 1U, 0x10UL
+    value = value.rstrip('uUlL')
+
+    if len(value) > 1 and value[0] == '0' and value.isdigit():
+        return int(value, 8)
+    else:
+        return int(value, 0)
+
+
+QUICKJS_FFI_C_FUNCTION = '''
+const _quickjs_ffi_c_function = (lib, name, nargs, ...c_types) => {
     try {
-        return __quickjs_ffi_wrap_ptr_func_decl(lib, name, nargs, ...types);
+        return new CFunction(lib, name, nargs, ...c_types);
     } catch (e) {
-        return undefined;
+        console.log('Warning:', name, e);
+        return null;
     }
 };
 '''
 
 
-CType = Union[str, dict]
+class CRecord:
+    __slots__ = ()
+    kind: str
+
+    def __repr__(self) -> str:
+        # keep shape of dict records, generated JS embeds this representation as object literal
+        return repr({'kind': self.kind, **{k: getattr(self, k) for k in self.__slots__}})
+
+
+@dataclass(repr=False)
+class CTypename(CRecord):
+    __slots__ = ('name', 'type')
+    kind = 'Typename'
+    name: Optional[str]
+    type: Any
+
+
+@dataclass(repr=False)
+class CPtrDecl(CRecord):
+    __slots__ = ('name', 'type')
+    kind = 'PtrDecl'
+    name: Optional[str]
+    type: Any
+
+
+@dataclass(repr=False)
+class CStruct(CRecord):
+    __slots__ = ('name', 'fields')
+    kind = 'Struct'
+    name: str
+    fields: dict
+
+
+@dataclass(repr=False)
+class CUnion(CRecord):
+    __slots__ = ('name', 'fields')
+    kind = 'Union'
+    name: str
+    fields: dict
+
+
+@dataclass(repr=False)
+class CEnum(CRecord):
+    __slots__ = ('name', 'items')
+    kind = 'Enum'
+    name: Optional[str]
+    items: dict
+
+
+@dataclass(repr=False)
+class CFuncDecl(CRecord):
+    __slots__ = ('name', 'return_type', 'params_types')
+    kind = 'FuncDecl'
+    name: Optional[str]
+    return_type: Any
+    params_types: list
+
+
+@dataclass(repr=False)
+class CPtrFuncDecl(CRecord):
+    __slots__ = ('return_type', 'params_types')
+    kind = 'PtrFuncDecl'
+    return_type: Any
+    params_types: list
+
+
+@dataclass(repr=False)
+class CTypedef(CRecord):
+    __slots__ = ('name', 'type')
+    kind = 'Typedef'
+    name: str
+    type: Any
+
+
+CType = Union[str, CRecord]
+
+
+class TranslationError(Exception):
+    pass
+
+
+def describe_error(e: Exception) -> str:
+    # repr of pycparser node dumps its whole subtree, report only node class and location
+    args: list[str] = []
+
+    for arg in e.args:
+        if isinstance(arg, c_ast.Node):
+            args.append(f'{type(arg).__name__} at {arg.coord}')
+        elif isinstance(arg, type):
+            args.append(arg.__name__)
+        else:
+            args.append(str(arg))
+
+    return f"{type(e).__name__}({', '.join(args)})"
 
 
 class CParser:
@@ -156,7 +346,8 @@ class CParser:
                  input_path: str,
                  output_path: str,
                  keep_going: bool,
-                 verbose: bool):
+                 verbose: bool,
+                 jobs: Optional[int] = None):
         self.frontend_compiler = frontend_compiler
         self.sizeof_cflags = sizeof_cflags
         self.sizeof_include = sizeof_include
@@ -167,86 +358,75 @@ class CParser:
         self.output_path = output_path
         self.keep_going = keep_going
         self.verbose = verbose
+        self.jobs = jobs if jobs is not None else (os.cpu_count() or 1)
 
-        self.CONSTS = ChainMap()
-        self.TYPE_DECL = ChainMap()
-        self.FUNC_DECL = ChainMap()
-        self.STRUCT_DECL = ChainMap()
-        self.UNION_DECL = ChainMap()
-        self.ENUM_DECL = ChainMap()
-        self.ARRAY_DECL = ChainMap()
-
-        self.TYPEDEF_STRUCT = ChainMap()
-        self.TYPEDEF_UNION = ChainMap()
-        self.TYPEDEF_ENUM = ChainMap()
-        self.TYPEDEF_FUNC_DECL = ChainMap()
-        self.TYPEDEF_PTR_DECL = ChainMap()
-        self.TYPEDEF_TYPE_DECL = ChainMap()
-
-
-    def push_new_processing_context(self):
-        self.CONSTS = self.CONSTS.new_child()
-        self.TYPE_DECL = self.TYPE_DECL.new_child()
-        self.FUNC_DECL = self.FUNC_DECL.new_child()
-        self.STRUCT_DECL = self.STRUCT_DECL.new_child()
-        self.UNION_DECL = self.UNION_DECL.new_child()
-        self.ENUM_DECL = self.ENUM_DECL.new_child()
-        self.ARRAY_DECL = self.ARRAY_DECL.new_child()
-        self.TYPEDEF_STRUCT = self.TYPEDEF_STRUCT.new_child()
-        self.TYPEDEF_UNION = self.TYPEDEF_UNION.new_child()
-        self.TYPEDEF_ENUM = self.TYPEDEF_ENUM.new_child()
-        self.TYPEDEF_FUNC_DECL = self.TYPEDEF_FUNC_DECL.new_child()
-        self.TYPEDEF_PTR_DECL = self.TYPEDEF_PTR_DECL.new_child()
-        self.TYPEDEF_TYPE_DECL = self.TYPEDEF_TYPE_DECL.new_child()
-
-
-    def pop_processing_context(self) -> dict[str, list[dict]]:
+        # same for every translated file, build it once
+        self.js_prelude: str = '\n'.join([
+            "import { CFunction, CCallback } from 'local/quickjs-cffi/quickjs-ffi.js';",
+            "import * as ffi from 'local/quickjs-cffi/quickjs-ffi.so';",
+            "export const malloc = ffi.malloc;",
+            "export const free = ffi.free;",
+            f"const LIB = {dumps(self.shared_library)};",
+            "const None = null;",
+            "",
+            QUICKJS_FFI_C_FUNCTION,
+            "",
+        ])
+
+        self.CONSTS: dict[str, Any] = {}
+        self.TYPE_DECL: dict[str, CType] = {}
+        self.FUNC_DECL: dict[str, CType] = {}
+        self.STRUCT_DECL: dict[str, CType] = {}
+        self.UNION_DECL: dict[str, CType] = {}
+        self.ENUM_DECL: dict[str, CType] = {}
+        self.ARRAY_DECL: dict[str, CType] = {}
+
+        self.TYPEDEF_STRUCT: dict[str, CType] = {}
+        self.TYPEDEF_UNION: dict[str, CType] = {}
+        self.TYPEDEF_ENUM: dict[str, CType] = {}
+        self.TYPEDEF_FUNC_DECL: dict[str, CType] = {}
+        self.TYPEDEF_PTR_DECL: dict[str, CType] = {}
+        self.TYPEDEF_TYPE_DECL: dict[str, CType] = {}
+
+
+    def pop_processing_context(self) -> dict[str, dict]:
         context = {
-            'CONSTS': self.CONSTS.maps,
-            'TYPE_DECL': self.TYPE_DECL.maps,
-            'FUNC_DECL': self.FUNC_DECL.maps,
-            'STRUCT_DECL': self.STRUCT_DECL.maps,
-            'UNION_DECL': self.UNION_DECL.maps,
-            'ENUM_DECL': self.ENUM_DECL.maps,
-            'ARRAY_DECL': self.ARRAY_DECL.maps,
-            'TYPEDEF_STRUCT': self.TYPEDEF_STRUCT.maps,
-            'TYPEDEF_UNION': self.TYPEDEF_UNION.maps,
-            'TYPEDEF_ENUM': self.TYPEDEF_ENUM.maps,
-            'TYPEDEF_FUNC_DECL': self.TYPEDEF_FUNC_DECL.maps,
-            'TYPEDEF_PTR_DECL': self.TYPEDEF_PTR_DECL.maps,
-            'TYPEDEF_TYPE_DECL': self.TYPEDEF_TYPE_DECL.maps,
+            'CONSTS': self.CONSTS,
+            'TYPE_DECL': self.TYPE_DECL,
+            'FUNC_DECL': self.FUNC_DECL,
+            'STRUCT_DECL': self.STRUCT_DECL,
+            'UNION_DECL': self.UNION_DECL,
+            'ENUM_DECL': self.ENUM_DECL,
+            'ARRAY_DECL': self.ARRAY_DECL,
+            'TYPEDEF_STRUCT': self.TYPEDEF_STRUCT,
+            'TYPEDEF_UNION': self.TYPEDEF_UNION,
+            'TYPEDEF_ENUM': self.TYPEDEF_ENUM,
+            'TYPEDEF_FUNC_DECL': self.TYPEDEF_FUNC_DECL,
+            'TYPEDEF_PTR_DECL': self.TYPEDEF_PTR_DECL,
+            'TYPEDEF_TYPE_DECL': self.TYPEDEF_TYPE_DECL,
         }
 
-        self.CONSTS = ChainMap()
-        self.TYPE_DECL = ChainMap()
-        self.FUNC_DECL = ChainMap()
-        self.STRUCT_DECL = ChainMap()
-        self.UNION_DECL = ChainMap()
-        self.ENUM_DECL = ChainMap()
-        self.ARRAY_DECL = ChainMap()
-        self.TYPEDEF_STRUCT = ChainMap()
-        self.TYPEDEF_UNION = ChainMap()
-        self.TYPEDEF_ENUM = ChainMap()
-        self.TYPEDEF_FUNC_DECL = ChainMap()
-        self.TYPEDEF_PTR_DECL = ChainMap()
-        self.TYPEDEF_TYPE_DECL = ChainMap()
+        self.CONSTS = {}
+        self.TYPE_DECL = {}
+        self.FUNC_DECL = {}
+        self.STRUCT_DECL = {}
+        self.UNION_DECL = {}
+        self.ENUM_DECL = {}
+        self.ARRAY_DECL = {}
+        self.TYPEDEF_STRUCT = {}
+        self.TYPEDEF_UNION = {}
+        self.TYPEDEF_ENUM = {}
+        self.TYPEDEF_FUNC_DECL = {}
+        self.TYPEDEF_PTR_DECL = {}
+        self.TYPEDEF_TYPE_DECL = {}
         return context
 
 
-    def push_processing_context(self, maps: dict[str, list[dict]]):
-        self.CONSTS = ChainMap(dict(self.CONSTS), *maps['CONSTS'])
-        self.TYPE_DECL = ChainMap(dict(self.TYPE_DECL), *maps['TYPE_DECL'])
-        self.FUNC_DECL = ChainMap(dict(self.FUNC_DECL), *maps['FUNC_DECL'])
-        self.STRUCT_DECL = ChainMap(dict(self.STRUCT_DECL), *maps['STRUCT_DECL'])
-        self.UNION_DECL = ChainMap(dict(self.UNION_DECL), *maps['UNION_DECL'])
-        self.ENUM_DECL = ChainMap(dict(self.ENUM_DECL), *maps['ENUM_DECL'])
-        self.ARRAY_DECL = ChainMap(dict(self.ARRAY_DECL), *maps['ARRAY_DECL'])
-        self.TYPEDEF_STRUCT = ChainMap(dict(self.TYPEDEF_STRUCT), *maps['TYPEDEF_STRUCT'])
-        self.TYPEDEF_UNION = ChainMap(dict(self.TYPEDEF_UNION), *maps['TYPEDEF_UNION'])
-        self.TYPEDEF_ENUM = ChainMap(dict(self.TYPEDEF_ENUM), *maps['TYPEDEF_ENUM'])
-        self.TYPEDEF_FUNC_DECL = ChainMap(dict(self.TYPEDEF_FUNC_DECL), *maps['TYPEDEF_FUNC_DECL'])
-        self.TYPEDEF_PTR_DECL = ChainMap(dict(self.TYPEDEF_PTR_DECL), *maps['TYPEDEF_PTR_DECL'])
-        self.TYPEDEF_TYPE_DECL = ChainMap(dict(self.TYPEDEF_TYPE_DECL), *maps['TYPEDEF_TYPE_DECL'])
+    def push_processing_context(self, context: dict[str, dict]):
+        # merge current context into previous one in place, current definitions take precedence
+        for name, prev_decls in context.items():
+            prev_decls.update(getattr(self, name))
+            setattr(self, name, prev_decls)
 
 
     def get_leaf_node(self, n):
@@ -256,10 +436,10 @@ class CParser:
             return n
 
 
-    def get_leaf_name(self, n) -> list[str]:
-        if isinstance(n, c_ast.IdentifierType):
+    def get_leaf_name(self, n) -> str:
+        if type(n) is c_ast.IdentifierType:
             if hasattr(n, 'names'):
-                return ' '.join(n.names)
+                return intern_name(' '.join(n.names))
             else:
                 return ''
         else:
@@ -273,14 +453,10 @@ class CParser:
         if decl:
             raise TypeError(type(n))
         elif func_decl:
-            js_name = n.name
+            js_name = intern_name(n.name)
             t = self.get_node(n.type, func_decl=func_decl)
 
-            js_type = {
-                'kind': 'Typename',
-                'name': js_name,
-                'type': t,
-            }
+            js_type = CTypename(js_name, t)
         else:
             raise TypeError(type(n))
 
@@ -292,13 +468,13 @@ class CParser:
         js_name: str | None = None
 
         if typedef:
-            js_name = typedef.name
+            js_name = intern_name(typedef.name)
 
-            if isinstance(n.type, c_ast.IdentifierType):
-                js_name = n.declname
+            if type(n.type) is c_ast.IdentifierType:
+                js_name = intern_name(n.declname)
                 js_type = self.get_leaf_name(n.type)
                 self.TYPEDEF_TYPE_DECL[js_name] = js_type
-            elif isinstance(n.type, c_ast.Enum):
+            elif type(n.type) is c_ast.Enum:
                 js_type = self.get_enum(n.type, typedef=typedef, type_decl=n)
                 
                 # js_type = {
@@ -310,14 +486,14 @@ class CParser:
                 if not js_name:
                     js_name = f'_{randint(0, 2 ** 64)}_enum'
                 
-                js_type['name'] = js_name
+                js_type.name = js_name
 
-                for item_name, item_value in js_type['items'].items():
+                for item_name, item_value in js_type.items.items():
                     self.CONSTS[item_name] = item_value
                 
                 if js_name not in self.ENUM_DECL:
                     self.TYPEDEF_ENUM[js_name] = js_type
-            elif isinstance(n.type, c_ast.Struct):
+            elif type(n.type) is c_ast.Struct:
                 js_type = self.get_struct(n.type, typedef=typedef, type_decl=n)
                 
                 # js_type = {
@@ -329,11 +505,11 @@ class CParser:
                 if not js_name:
                     js_name = f'_{randint(0, 2 ** 64)}_struct'
                 
-                js_type['name'] = js_name
+                js_type.name = js_name
 
                 if js_name not in self.STRUCT_DECL:
                     self.TYPEDEF_STRUCT[js_name] = js_type
-            elif isinstance(n.type, c_ast.Union):
+            elif type(n.type) is c_ast.Union:
                 js_type = self.get_union(n.type, typedef=typedef, type_decl=n)
                 
                 # js_type = {
@@ -345,29 +521,29 @@ class CParser:
                 if not js_name:
                     js_name = f'_{randint(0, 2 ** 64)}_union'
 
-                js_type['name'] = js_name
+                js_type.name = js_name
                 
                 if js_name not in self.UNION_DECL:
                     self.TYPEDEF_UNION[js_name] = js_type
             else:
                 raise TypeError(n)
         elif decl or func_decl:
-            if isinstance(n.type, c_ast.IdentifierType):
-                js_name = n.declname
+            if type(n.type) is c_ast.IdentifierType:
+                js_name = intern_name(n.declname)
                 js_type = self.get_leaf_name(n.type)
                 self.TYPE_DECL[js_name] = js_type
-            elif isinstance(n.type, c_ast.PtrDecl):
+            elif type(n.type) is c_ast.PtrDecl:
                 js_type = self.get_ptr_decl(n.type, decl=decl, func_decl=func_decl)
-                js_name = decl.name
+                js_name = intern_name(decl.name)
 
                 # js_type = {
                 #     'kind': 'TypeDecl',
                 #     'name': js_name,
                 #     'type': t,
                 # }
-            elif isinstance(n.type, c_ast.Enum):
+            elif type(n.type) is c_ast.Enum:
                 js_type = self.get_enum(n.type, type_decl=n)
-                js_name = n.declname
+                js_name = intern_name(n.declname)
 
                 # js_type = {
                 #     'kind': 'TypeDecl',
@@ -378,14 +554,14 @@ class CParser:
                 if not js_name:
                     js_name = f'_{randint(0, 2 ** 64)}_enum'
 
-                js_type['name'] = js_name
+                js_type.name = js_name
                     
-                for item_name, item_value in js_type['type']['items'].items():
+                for item_name, item_value in js_type.items.items():
                     self.CONSTS[item_name] = item_value
                 
                 if js_name not in self.TYPEDEF_ENUM:
                     self.ENUM_DECL[js_name] = js_type
-            elif isinstance(n.type, c_ast.Struct):
+            elif type(n.type) is c_ast.Struct:
                 js_type = self.get_struct(n.type, type_decl=n)
                 
                 # js_type = {
@@ -397,11 +573,11 @@ class CParser:
                 if not js_name:
                     js_name = f'_{randint(0, 2 ** 64)}_struct'
 
-                js_type['name'] = js_name
+                js_type.name = js_name
                 
                 if js_name not in self.TYPEDEF_STRUCT:
                     self.STRUCT_DECL[js_name] = js_type
-            elif isinstance(n.type, c_ast.Union):
+            elif type(n.type) is c_ast.Union:
                 js_type = self.get_union(n.type, type_decl=n)
                 
                 # js_type = {
@@ -413,29 +589,29 @@ class CParser:
                 if not js_name:
                     js_name = f'_{randint(0, 2 ** 64)}_union'
 
-                js_type['name'] = js_name
+                js_type.name = js_name
                 
                 if js_name not in self.TYPEDEF_UNION:
                     self.UNION_DECL[js_name] = js_type
             else:
                 raise TypeError(n)
         else:
-            if isinstance(n.type, c_ast.IdentifierType):
-                js_name = n.declname
+            if type(n.type) is c_ast.IdentifierType:
+                js_name = intern_name(n.declname)
                 js_type = self.get_leaf_name(n.type)
                 self.TYPE_DECL[js_name] = js_type
-            elif isinstance(n.type, c_ast.PtrDecl):
+            elif type(n.type) is c_ast.PtrDecl:
                 js_type = self.get_ptr_decl(n.type, decl=decl, func_decl=func_decl)
-                js_name = decl.name
+                js_name = intern_name(decl.name)
 
                 # js_type = {
                 #     'kind': 'TypeDecl',
                 #     'name': js_name,
                 #     'type': t,
                 # }
-            elif isinstance(n.type, c_ast.Enum):
+            elif type(n.type) is c_ast.Enum:
                 js_type = self.get_enum(n.type, typedef=typedef, type_decl=n)
-                js_name = n.declname
+                js_name = intern_name(n.declname)
 
                 # js_type = {
                 #     'kind': 'TypeDecl',
@@ -446,14 +622,14 @@ class CParser:
                 if not js_name:
                     js_name = f'_{randint(0, 2 ** 64)}_enum'
 
-                js_type['name'] = js_name
+                js_type.name = js_name
                     
-                for item_name, item_value in js_type['type']['items'].items():
+                for item_name, item_value in js_type.items.items():
                     self.CONSTS[item_name] = item_value
                 
                 if js_name not in self.TYPEDEF_ENUM:
                     self.ENUM_DECL[js_name] = js_type
-            elif isinstance(n.type, c_ast.Struct):
+            elif type(n.type) is c_ast.Struct:
                 js_type = self.get_struct(n.type, typedef=typedef, type_decl=n)
                 
                 # js_type = {
@@ -465,11 +641,11 @@ class CParser:
                 if not js_name:
                     js_name = f'_{randint(0, 2 ** 64)}_struct'
 
-                js_type['name'] = js_name
+                js_type.name = js_name
                 
                 if js_name not in self.TYPEDEF_STRUCT:
                     self.STRUCT_DECL[js_name] = js_type
-            elif isinstance(n.type, c_ast.Union):
+            elif type(n.type) is c_ast.Union:
                 js_type = self.get_union(n.type, typedef=typedef, type_decl=n)
                 
                 # js_type = {
@@ -481,7 +657,7 @@ class CParser:
                 if not js_name:
                     js_name = f'_{randint(0, 2 ** 64)}_union'
 
-                js_type['name'] = js_name
+                js_type.name = js_name
                 
                 if js_name not in self.TYPEDEF_UNION:
                     self.UNION_DECL[js_name] = js_type
@@ -497,13 +673,9 @@ class CParser:
 
         if typedef:
             t = self.get_node(n.type, typedef=typedef, ptr_decl=n)
-            js_name = typedef.name
+            js_name = intern_name(typedef.name)
 
-            js_type = {
-                'kind': 'PtrDecl',
-                'name': js_name,
-                'type': t,
-            }
+            js_type = CPtrDecl(js_name, t)
 
             if not js_name:
                 js_name = f'_{randint(0, 2 ** 64)}_ptr_decl'
@@ -513,20 +685,12 @@ class CParser:
             t = self.get_node(n.type, decl=decl, ptr_decl=n)
             js_name = None # NOTE: in this implementation is always None, but can be set to real name
 
-            js_type = {
-                'kind': 'PtrDecl',
-                'name': js_name,
-                'type': t,
-            }
+            js_type = CPtrDecl(js_name, t)
         elif func_decl:
             t = self.get_node(n.type, func_decl=func_decl, ptr_decl=n)
             js_name = None # NOTE: in this implementation is always None, but can be set to real name
 
-            js_type = {
-                'kind': 'PtrDecl',
-                'name': js_name,
-                'type': t,
-            }
+            js_type = CPtrDecl(js_name, t)
         else:
             raise TypeError(type(n))
         
@@ -539,22 +703,18 @@ class CParser:
         js_fields: dict
         
         if n.name:
-            js_name = n.name
+            js_name = intern_name(n.name)
         elif type_decl and type_decl.declname:
-            js_name = type_decl.declname
+            js_name = intern_name(type_decl.declname)
         elif typedef and typedef.name:
-            js_name = typedef.name
+            js_name = intern_name(typedef.name)
         else:
             raise ValueError(f'Could not get name of struct node {n}')
 
         # NOTE: does not parse struct fields
         js_fields = {}
 
-        js_type = {
-            'kind': 'Struct',
-            'name': js_name,
-            'fields': js_fields,
-        }
+        js_type = CStruct(js_name, js_fields)
 
         if not js_name:
             js_name = f'_{randint(0, 2 ** 64)}_struct'
@@ -569,22 +729,18 @@ class CParser:
         js_fields: dict
         
         if n.name:
-            js_name = n.name
+            js_name = intern_name(n.name)
         elif type_decl and type_decl.declname:
-            js_name = type_decl.declname
+            js_name = intern_name(type_decl.declname)
         elif typedef and typedef.name:
-            js_name = typedef.name
+            js_name = intern_name(typedef.name)
         else:
             raise ValueError(f'Could not get name of union node {n}')
 
         # NOTE: does not parse struct fields
         js_fields = {}
 
-        js_type = {
-            'kind': 'Union',
-            'name': js_name,
-            'fields': js_fields,
-        }
+        js_type = CUnion(js_name, js_fields)
 
         if not js_name:
             js_name = f'_{randint(0, 2 ** 64)}_union'
@@ -598,30 +754,27 @@ class CParser:
         js_type: CType
         
         
-        def eval_op(n):
-            if isinstance(n, c_ast.Constant):
-                return eval(n.value)
-            elif isinstance(n, c_ast.UnaryOp):
-                return eval(f'{n.op} {eval_op(n.expr)}')
-            elif isinstance(n, c_ast.BinaryOp):
-                return eval(f'{eval_op(n.left)} {n.op} {eval_op(n.right)}')
+        def eval_op(n) -> int:
+            if type(n) is c_ast.Constant:
+                return eval_enum_constant(n.type, n.value)
+            elif type(n) is c_ast.UnaryOp and n.op in ENUM_UNARY_OPS:
+                return ENUM_UNARY_OPS[n.op](eval_op(n.expr))
+            elif type(n) is c_ast.BinaryOp and n.op in ENUM_BINARY_OPS:
+                return ENUM_BINARY_OPS[n.op](eval_op(n.left), eval_op(n.right))
             else:
                 raise TypeError(f'get_enum: Unsupported {type(n)}')
 
 
         if decl or type_decl:
-            assert isinstance(n.values, c_ast.EnumeratorList)
+            assert type(n.values) is c_ast.EnumeratorList
             assert isinstance(n.values.enumerators, list)
             last_enum_field_value: int = -1
 
-            js_type = {
-                'kind': 'Enum',
-                'name': n.name,
-                'items': {},
-            }
+            js_type = CEnum(intern_name(n.name), {})
+            set_item = js_type.items.__setitem__
 
             for m in n.values.enumerators:
-                enum_field_name: str = m.name
+                enum_field_name: str = intern_name(m.name)
                 enum_field_value: Any
                 
                 if m.value:
@@ -630,9 +783,9 @@ class CParser:
                     enum_field_value = last_enum_field_value + 1
                 
                 last_enum_field_value = enum_field_value
-                js_type['items'][enum_field_name] = enum_field_value
+                set_item(enum_field_name, enum_field_value)
 
-            js_name = js_type['name']
+            js_name = js_type.name
 
             if not js_name:
                 js_name = f'_{randint(0, 2 ** 64)}_enum'
@@ -645,7 +798,7 @@ class CParser:
 
 
     def get_func_decl(self, n, typedef=None, decl=None, ptr_decl=None) -> CType:
-        assert isinstance(n.args, c_ast.ParamList)
+        assert type(n.args) is c_ast.ParamList
         assert isinstance(n.args.params, list)
         js_type: CType = None
         js_name: str | None = None
@@ -653,33 +806,28 @@ class CParser:
         decl_js_name: str | None = None
 
         if typedef:
-            typedef_js_name = typedef.name
+            typedef_js_name = intern_name(typedef.name)
             
             if hasattr(n.type, 'declname'):
-                decl_js_name = n.type.declname
+                decl_js_name = intern_name(n.type.declname)
             else:
-                decl_js_name = n.type.type.declname
+                decl_js_name = intern_name(n.type.type.declname)
             
             js_name = decl_js_name
         elif decl:
-            decl_js_name = decl.name
+            decl_js_name = intern_name(decl.name)
             js_name = decl_js_name
 
-        js_type = {
-            'kind': 'FuncDecl',
-            'name': js_name,
-            'return_type': None,
-            'params_types': [],
-        }
+        js_type = CFuncDecl(js_name, None, [])
 
         # return type
         t = self.get_node(n.type, typedef=typedef, func_decl=n, ptr_decl=ptr_decl)
-        js_type['return_type'] = t
+        js_type.return_type = t
 
         # params types
         for m in n.args.params:
             t = self.get_node(m, func_decl=n)
-            js_type['params_types'].append(t)
+            js_type.params_types.append(t)
 
         if not ptr_decl and typedef_js_name:
             self.TYPEDEF_FUNC_DECL[typedef_js_name] = js_type
@@ -698,64 +846,67 @@ class CParser:
 
     def get_typedef(self, n) -> CType:
         js_type: CType
-        js_name: str = n.name
+        js_name: str = intern_name(n.name)
+
+        t_type = type(n.type)
 
-        if isinstance(n.type, c_ast.TypeDecl):
+        # exact class checks, ordered by how often each node class appears
+        if t_type is c_ast.TypeDecl:
             t = self.get_type_decl(n.type, typedef=n)
-        elif isinstance(n.type, c_ast.FuncDecl):
-            t = self.get_func_decl(n.type, typedef=n)
-        elif isinstance(n.type, c_ast.PtrDecl):
+        elif t_type is c_ast.PtrDecl:
             t = self.get_ptr_decl(n.type, typedef=n)
+        elif t_type is c_ast.FuncDecl:
+            t = self.get_func_decl(n.type, typedef=n)
         else:
             raise TypeError(type(n.type))
 
-        js_type = {
-            'kind': 'Typedef',
-            'name': js_name,
-            'type': t,
-        }
+        js_type = CTypedef(js_name, t)
 
         return js_type
 
 
     def get_decl(self, n, func_decl=None) -> CType:
         js_type: CType = None
+        t_type = type(n.type)
 
-        if isinstance(n.type, c_ast.Enum):
-            js_type = self.get_enum(n.type, decl=n)
-        elif isinstance(n.type, c_ast.TypeDecl):
+        # exact class checks, ordered by how often each node class appears
+        if t_type is c_ast.TypeDecl:
             js_type = self.get_type_decl(n.type, decl=n)
-        elif isinstance(n.type, c_ast.FuncDecl):
+        elif t_type is c_ast.FuncDecl:
             js_type = self.get_func_decl(n.type, decl=n)
-        elif isinstance(n.type, c_ast.PtrDecl):
+        elif t_type is c_ast.PtrDecl:
             js_type = self.get_ptr_decl(n.type, decl=n)
-        elif isinstance(n.type, c_ast.ArrayDecl):
-            js_type = self.get_array_decl(n.type, decl=n)
-        elif isinstance(n.type, c_ast.Struct):
+        elif t_type is c_ast.Struct:
             js_type = self.get_type_decl(n, decl=n, func_decl=func_decl)
-        elif isinstance(n.type, c_ast.Union):
+        elif t_type is c_ast.Enum:
+            js_type = self.get_enum(n.type, decl=n)
+        elif t_type is c_ast.Union:
             js_type = self.get_type_decl(n, decl=n, func_decl=func_decl)
+        elif t_type is c_ast.ArrayDecl:
+            js_type = self.get_array_decl(n.type, decl=n)
         else:
             raise TypeError(type(n.type))
-        
+
         return js_type
 
 
     def get_node(self, n, typedef=None, decl=None, ptr_decl=None, func_decl=None) -> CType:
         # NOTE: typedef unused
         js_type: CType = None
+        n_type = type(n)
 
-        if isinstance(n, c_ast.Decl):
+        # exact class checks, ordered by how often each node class appears
+        if n_type is c_ast.Decl:
             js_type = self.get_decl(n, func_decl=func_decl)
-        elif isinstance(n, c_ast.TypeDecl):
+        elif n_type is c_ast.Typename:
+            js_type = self.get_typename(n, decl=decl, func_decl=func_decl)
+        elif n_type is c_ast.TypeDecl:
             js_type = self.get_type_decl(n, decl=decl, func_decl=func_decl)
-        elif isinstance(n, c_ast.PtrDecl):
+        elif n_type is c_ast.PtrDecl:
             js_type = self.get_ptr_decl(n, decl=decl, func_decl=func_decl)
-        elif isinstance(n, c_ast.FuncDecl):
+        elif n_type is c_ast.FuncDecl:
             js_type = self.get_func_decl(n, typedef=typedef, decl=decl, ptr_decl=ptr_decl)
-        elif isinstance(n, c_ast.Typename):
-            js_type = self.get_typename(n, decl=decl, func_decl=func_decl)
-        elif isinstance(n, c_ast.EllipsisParam):
+        elif n_type is c_ast.EllipsisParam:
             pass
         else:
             raise TypeError(n)
@@ -767,26 +918,24 @@ class CParser:
         js_type: CType = None
 
         for n in file_ast.ext:
-            # print(n)
-
-            if isinstance(n, c_ast.Typedef):
+            if type(n) is c_ast.Typedef:
                 js_type = self.get_typedef(n)
-            elif isinstance(n, c_ast.Decl):
+            elif type(n) is c_ast.Decl:
                 js_type = self.get_decl(n)
             else:
                 raise TypeError(type(n.type))
 
 
-    def simplify_type(self, js_type: Union[str, dict]) -> CType:
+    def simplify_type(self, js_type: CType) -> CType:
         output_js_type: CType
 
-        if isinstance(js_type, dict) and js_type['kind'] == 'PtrDecl':
-            if js_type['type'] == 'char':
+        if isinstance(js_type, CPtrDecl):
+            if js_type.type == 'char':
                 output_js_type = 'string'
             else:
                 output_js_type = 'pointer'
-        elif isinstance(js_type, dict) and js_type['kind'] == 'Typename':
-            output_js_type = self.simplify_type(js_type['type'])
+        elif isinstance(js_type, CTypename):
+            output_js_type = self.simplify_type(js_type.type)
         elif isinstance(js_type, str):
             js_name = js_type
             
@@ -804,6 +953,42 @@ class CParser:
         return output_js_type
 
 
+    def get_c_func_type(self, js_type: CType) -> Optional[str]:
+        if isinstance(js_type, str):
+            return js_type
+        elif isinstance(js_type, CPtrDecl):
+            return 'string' if js_type.type == 'char' else 'pointer'
+        elif isinstance(js_type, CPtrFuncDecl):
+            return 'pointer'
+        else:
+            # unsupported
+            return None
+
+
+    def get_js_func(self, js_name: str, return_type: CType, params_types: list[CType]) -> str:
+        # C function types are known here, emit wrapper specialized for them instead of converting on each call
+        c_types = [self.get_c_func_type(t) for t in [return_type, *params_types]]
+
+        if None in c_types:
+            return 'undefined'
+
+        js_args: list[str] = []
+        c_args: list[str] = []
+
+        for i, pt in enumerate(params_types):
+            js_arg = f'a{i}'
+            js_args.append(js_arg)
+
+            if isinstance(pt, CPtrFuncDecl):
+                cb_types = ', '.join(dumps(t) if isinstance(t, str) else repr(t) for t in [pt.return_type, *pt.params_types])
+                c_args.append(f'new CCallback({js_arg}, null, {cb_types}).cfuncptr')
+            else:
+                c_args.append(js_arg)
+
+        c_func = f"_quickjs_ffi_c_function(LIB, {dumps(js_name)}, null, {', '.join(dumps(t) for t in c_types)})"
+        return f"(() => {{ const c_func = {c_func}; return ({', '.join(js_args)}) => c_func.invoke({', '.join(c_args)}); }})()"
+
+
     def create_output_dir(self, output_path: str):
         dirpath, filename = os.path.split(output_path)
         
@@ -811,17 +996,108 @@ class CParser:
             os.makedirs(dirpath, exist_ok=True)
 
 
-    def preprocess_header_file(self, compiler: str, cflags: list[str], input_path: str, output_path: str):
-        # print('DEFAULT_FRONTEND_CFLAGS', DEFAULT_FRONTEND_CFLAGS)
-        # print('cflags', cflags)
-        new_cflags = DEFAULT_FRONTEND_CFLAGS + cflags
-        cmd = [compiler, '-E', *new_cflags, input_path]
+    @staticmethod
+    def parse_header_file(frontend_compiler: str, frontend_cflags: list[str], input_path: str) -> c_ast.FileAST:
+        # NOTE: runs in worker processes, must not depend on translator state
+        # preprocess input header file, -P omits linemarkers which pycparser would otherwise lex and skip
+        cmd = [frontend_compiler, '-E', '-P', *DEFAULT_FRONTEND_CFLAGS, *frontend_cflags, input_path]
         output: bytes = subprocess.check_output(cmd)
-        
-        with open(output_path, 'w+b') as f:
-            f.write(output)
 
-    
+        # AST cache is keyed by preprocessed source and pycparser version
+        h = hashlib.blake2b(output, digest_size=16)
+        h.update(pycparser.__version__.encode())
+        dirpath, filename = os.path.split(input_path)
+        basename, ext = os.path.splitext(filename)
+        cache_dir = get_ast_cache_dir()
+        cache_path = os.path.join(cache_dir, f'{basename}.{h.hexdigest()}.pkl') if cache_dir else None
+
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'rb') as f:
+                    file_ast = pickle.load(f)
+
+                # mark entry as recently used
+                os.utime(cache_path)
+                return file_ast
+            except Exception as e:
+                # corrupted or incompatible cache entry, parse again
+                pass
+
+        # parse preprocessed source
+        file_ast = pycparser.CParser().parse(output.decode('utf-8'), input_path)
+
+        if not cache_path:
+            return file_ast
+
+        # store AST, write to temporary file first so concurrent runs never see partial entry
+        tmp_cache_path = f'{cache_path}.{os.getpid()}.tmp'
+
+        try:
+            with open(tmp_cache_path, 'wb') as f:
+                pickle.dump(file_ast, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+            os.replace(tmp_cache_path, cache_path)
+        except (pickle.PicklingError, RecursionError, OSError) as e:
+            # AST could not be cached, it is still valid
+            if os.path.exists(tmp_cache_path):
+                os.remove(tmp_cache_path)
+        else:
+            prune_ast_cache(cache_dir)
+
+        return file_ast
+
+
+    def parse_header_files(self, input_paths: list[str]) -> Iterator[tuple[str, Optional[c_ast.FileAST], Optional[Exception]]]:
+        # single header or job, parse in this process, pickling large AST back from worker costs more than parsing
+        if len(input_paths) == 1 or self.jobs == 1:
+            for input_path in input_paths:
+                try:
+                    file_ast = self.parse_header_file(self.frontend_compiler, self.frontend_cflags, input_path)
+                except Exception as e:
+                    yield input_path, None, e
+                else:
+                    yield input_path, file_ast, None
+
+                file_ast = None
+
+            return
+
+        # headers do not depend on each other, parse them in parallel
+        # only limited number of headers is parsed ahead, so only few ASTs are kept in memory at once
+        executor = ProcessPoolExecutor(max_workers=self.jobs)
+        next_input_paths = iter(input_paths)
+        pending = deque()
+
+        def submit_next():
+            input_path = next(next_input_paths, None)
+
+            if input_path is not None:
+                future = executor.submit(self.parse_header_file, self.frontend_compiler, self.frontend_cflags, input_path)
+                pending.append((input_path, future))
+
+
+        try:
+            for _ in range(2 * self.jobs):
+                submit_next()
+
+            while pending:
+                input_path, future = pending.popleft()
+                submit_next()
+
+                try:
+                    file_ast = future.result()
+                except Exception as e:
+                    yield input_path, None, e
+                else:
+                    yield input_path, file_ast, None
+
+                # release consumed AST
+                future = file_ast = None
+        finally:
+            # on error do not wait for headers nobody will use
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
     def _get_size_of(self, js_name: str) -> int:
         cmd = f"""
             rm -f ./a.out
@@ -859,75 +1135,61 @@ class CParser:
             return -1
 
 
-    def translate_to_js(self) -> str:
-        lines: list[str] = [
-            "import { CFunction, CCallback } from 'local/quickjs-cffi/quickjs-ffi.js';",
-            "import * as ffi from 'local/quickjs-cffi/quickjs-ffi.so';",
-            "export const malloc = ffi.malloc;",
-            "export const free = ffi.free;",
-            f"const LIB = {dumps(self.shared_library)};",
-            "const None = null;",
-            "",
-            QUICKJS_FFI_WRAP_PTR_FUNC_DECL,
-            "",
-        ]
+    def translate_to_js(self) -> Iterator[str]:
+        yield self.js_prelude
 
         # CONSTS
         line = 'export const CONSTS = {'
-        lines.append(line)
+        yield line
 
         for js_name, value in self.CONSTS.items():
             line = f'    {js_name}: {value},'
-            lines.append(line)
+            yield line
 
         line = '};'
-        lines.append(line)
+        yield line
 
         # TYPEDEF_ENUM
         for js_name, js_type in self.TYPEDEF_ENUM.items():
-            line = f"export const {js_name} = {js_type['items']};"
+            line = f"export const {js_name} = {js_type.items};"
             line += f"/* TYPEDEF_ENUM: {js_name} {js_type} */"
-            lines.append(line)
+            yield line
         
         # ENUM_DECL
         for js_name, js_type in self.ENUM_DECL.items():
-            line = f"export const {js_name} = {js_type['items']};"
+            line = f"export const {js_name} = {js_type.items};"
             line += f"/* ENUM_DECL: {js_name} {js_type} */"
-            lines.append(line)
+            yield line
 
         # TYPEDEF_FUNC_DECL
         for js_name, js_type in self.TYPEDEF_FUNC_DECL.items():
             line = f"/* TYPEDEF_FUNC_DECL: {js_name} {js_type} */"
-            lines.append(line)
+            yield line
 
         # TYPEDEF_PTR_DECL
         for js_name, js_type in self.TYPEDEF_PTR_DECL.items():
             line = f"/* TYPEDEF_PTR_DECL: {js_name} {js_type} */"
-            lines.append(line)
+            yield line
 
         # FUNC_DECL
         for js_name, js_type in self.FUNC_DECL.items():
-            return_type = js_type['return_type']
-            params_types = js_type['params_types']
+            return_type = js_type.return_type
+            params_types = js_type.params_types
 
             # prepare params_types
             _params_types = []
 
             for pt in params_types:
-                if isinstance(pt, dict):
-                    if pt['kind'] == 'Typename':
-                        pt = pt['type']
+                if isinstance(pt, CRecord):
+                    if isinstance(pt, CTypename):
+                        pt = pt.type
 
-                        if isinstance(pt, dict) and isinstance(pt['type'], str) and pt['type'] in self.TYPEDEF_FUNC_DECL:
-                            typedef_func_decl = self.TYPEDEF_FUNC_DECL[pt['type']]
-                            typedef_func_decl_return_type = self.simplify_type(typedef_func_decl['return_type'])
-                            typedef_func_decl_params_types = [self.simplify_type(n) for n in typedef_func_decl['params_types']]
+                        if isinstance(pt, CRecord) and isinstance(getattr(pt, 'type', None), str) and pt.type in self.TYPEDEF_FUNC_DECL:
+                            typedef_func_decl = self.TYPEDEF_FUNC_DECL[pt.type]
+                            typedef_func_decl_return_type = self.simplify_type(typedef_func_decl.return_type)
+                            typedef_func_decl_params_types = [self.simplify_type(n) for n in typedef_func_decl.params_types]
 
-                            new_pt = {
-                                'kind': 'PtrFuncDecl',
-                                'return_type': typedef_func_decl_return_type,
-                                'params_types': typedef_func_decl_params_types,
-                            }
+                            new_pt = CPtrFuncDecl(typedef_func_decl_return_type, typedef_func_decl_params_types)
 
                             _params_types.append(new_pt)
                         else:
@@ -949,16 +1211,12 @@ class CParser:
                     if pt in self.TYPEDEF_PTR_DECL:
                         tpd = self.TYPEDEF_PTR_DECL[pt]
 
-                        if tpd['kind'] == 'PtrDecl' and isinstance(tpd['type'], dict) and tpd['type']['kind'] == 'FuncDecl':
-                            typedef_func_decl = tpd['type']
-                            typedef_func_decl_return_type = self.simplify_type(typedef_func_decl['return_type'])
-                            typedef_func_decl_params_types = [self.simplify_type(n) for n in typedef_func_decl['params_types']]
+                        if isinstance(tpd, CPtrDecl) and isinstance(tpd.type, CFuncDecl):
+                            typedef_func_decl = tpd.type
+                            typedef_func_decl_return_type = self.simplify_type(typedef_func_decl.return_type)
+                            typedef_func_decl_params_types = [self.simplify_type(n) for n in typedef_func_decl.params_types]
 
-                            new_pt = {
-                                'kind': 'PtrFuncDecl',
-                                'return_type': typedef_func_decl_return_type,
-                                'params_types': typedef_func_decl_params_types,
-                            }
+                            new_pt = CPtrFuncDecl(typedef_func_decl_return_type, typedef_func_decl_params_types)
 
                             _params_types.append(new_pt)
                         else:
@@ -971,13 +1229,11 @@ class CParser:
                     _params_types.append(pt)
 
             params_types = _params_types
-            # print('!', js_name, return_type, params_types)
 
             # export of func
-            types = [return_type, *params_types]
-            line = f"export const {js_name} = _quickjs_ffi_wrap_ptr_func_decl(LIB, {dumps(js_name)}, null, ...{types});"
+            line = f"export const {js_name} = {self.get_js_func(js_name, return_type, params_types)};"
             line += f"/* FUNC_DECL: {js_name} {js_type} */"
-            lines.append(line)
+            yield line
 
         # STRUCT_DECL
         for js_name, js_type in self.STRUCT_DECL.items():
@@ -987,7 +1243,7 @@ class CParser:
             size = self.get_size_of(js_name)
             line = f'export const sizeof_{js_name} = {size};' 
             line += f"/* STRUCT_DECL: {js_name} {js_type} */"
-            lines.append(line)
+            yield line
 
         # UNION_DECL
         for js_name, js_type in self.UNION_DECL.items():
@@ -997,7 +1253,7 @@ class CParser:
             size = self.get_size_of(js_name)
             line = f'export const sizeof_{js_name} = {size};' 
             line += f"/* UNION_DECL: {js_name} {js_type} */"
-            lines.append(line)
+            yield line
 
         # TYPEDEF_STRUCT
         for js_name, js_type in self.TYPEDEF_STRUCT.items():
@@ -1007,7 +1263,7 @@ class CParser:
             size = self.get_size_of(js_name)
             line = f'export const sizeof_{js_name} = {size};' 
             line += f"/* TYPEDEF_STRUCT: {js_name} {js_type} */"
-            lines.append(line)
+            yield line
 
         # TYPEDEF_UNION
         for js_name, js_type in self.TYPEDEF_UNION.items():
@@ -1017,10 +1273,54 @@ class CParser:
             size = self.get_size_of(js_name)
             line = f'export const sizeof_{js_name} = {size};' 
             line += f"/* TYPEDEF_UNION: {js_name} {js_type} */"
-            lines.append(line)
+            yield line
+
+
+
+    def write_js(self, output_path: str):
+        # stream translated lines, encode them once and write in large batches to raw fd
+        def write_all(fd: int, data: bytes):
+            view = memoryview(data)
+
+            while view:
+                view = view[os.write(fd, view):]
+
+
+        # write to temporary file first, failed translation must not leave partial or empty output behind,
+        # replace symlink's target instead of symlink itself
+        output_path = os.path.realpath(output_path)
+        tmp_output_path = f'{output_path}.{os.getpid()}.tmp'
+
+        # like open(), new output is created with umask applied, existing output keeps its mode
+        fd = os.open(tmp_output_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+
+        try:
+            try:
+                os.fchmod(fd, os.stat(output_path).st_mode & 0o7777)
+            except FileNotFoundError:
+                pass
+
+            batch: list[bytes] = []
+            batch_size: int = 0
 
-        output: str = '\n'.join(lines)
-        return output
+            for line in self.translate_to_js():
+                data = f'{line}\n'.encode('utf-8')
+                batch.append(data)
+                batch_size += len(data)
+
+                if batch_size >= JS_WRITE_BATCH_SIZE:
+                    write_all(fd, b''.join(batch))
+                    batch.clear()
+                    batch_size = 0
+
+            write_all(fd, b''.join(batch))
+        except BaseException:
+            os.close(fd)
+            os.remove(tmp_output_path)
+            raise
+
+        os.close(fd)
+        os.replace(tmp_output_path, output_path)
 
 
     def translate(self):
@@ -1067,78 +1367,49 @@ class CParser:
         # create destination directory if does not exist
         self.create_output_dir(self.output_path)
 
-        # process input files
-        run_id = str(uuid4())
-        processed_input_paths: list[str] = []
-
-        for input_path in input_paths:
-            # new processing context
-            self.push_new_processing_context()
-
-            # preprocess input header path
-            dirpath, filename = os.path.split(input_path)
-            basename, ext = os.path.splitext(filename)
-            processed_input_path = os.path.join('/tmp', f'_{run_id}_{basename}.h')
-
-            # preprocess input header file
-            try:
-                self.preprocess_header_file(self.frontend_compiler, self.frontend_cflags, input_path, processed_input_path)
-            except Exception as e:
-                if self.keep_going:
-                    print('skipped [0]:', processed_input_path)
-                    continue
-                else:
-                    print('error parsing [0]:', processed_input_path)
-                    raise e
+        # process input files in order, with single output file declarations of previous files are visible to next ones
+        with closing(self.parse_header_files(input_paths)) as parsed_header_files:
+            for input_path, file_ast, e in parsed_header_files:
+                dirpath, filename = os.path.split(input_path)
+                basename, ext = os.path.splitext(filename)
 
-            # parse input header path
-            try:
-                file_ast = parse_file(processed_input_path, use_cpp=True)
-            except Exception as e:
-                if self.keep_going:
-                    print('skipped [1]:', processed_input_path)
-                    continue
-                else:
-                    print('error parsing [1]:', processed_input_path)
-                    raise e
-
-            processed_input_paths.append(processed_input_path)
-            assert isinstance(file_ast, c_ast.FileAST)
+                # preprocessed and parsed input header file
+                if e is not None:
+                    if self.keep_going:
+                        print('skipped:', input_path)
+                        continue
+                    else:
+                        raise TranslationError(f'error parsing {input_path}: {e}') from e
 
-            # output individual files if required
-            if output_path_is_dir:
-                # pop processing context
-                prev_context = self.pop_processing_context()
+                assert type(file_ast) is c_ast.FileAST
 
-            # process C ast
-            self.get_file_ast(file_ast, shared_library=self.shared_library)
+                # output individual files if required
+                if output_path_is_dir:
+                    # pop processing context
+                    prev_context = self.pop_processing_context()
 
-            # output individual files if required
-            if output_path_is_dir:
-                # translate processed header files
-                output_data: str = self.translate_to_js()
-                output_path = os.path.join(self.output_path, f'{basename}.js')
+                # process C ast
+                try:
+                    self.get_file_ast(file_ast, shared_library=self.shared_library)
+                except Exception as e:
+                    raise TranslationError(f'error translating {input_path}: {describe_error(e)}') from e
 
-                # create destination directory if does not exist
-                self.create_output_dir(output_path)
+                # output individual files if required
+                if output_path_is_dir:
+                    # translate processed header files
+                    output_path = os.path.join(self.output_path, f'{basename}.js')
 
-                with open(output_path, 'w+') as f:
-                    f.write(output_data)
+                    # create destination directory if does not exist
+                    self.create_output_dir(output_path)
+                    self.write_js(output_path)
 
-                # restore processing context
-                self.push_processing_context(prev_context)
+                    # restore processing context
+                    self.push_processing_context(prev_context)
 
         # output single file if required
         if not output_path_is_dir:
             # translate processed header files
-            output_data: str = self.translate_to_js()
-            
-            with open(self.output_path, 'w+') as f:
-                f.write(output_data)
-
-        # cleanup
-        for processed_input_path in processed_input_paths:
-            os.remove(processed_input_path)
+            self.write_js(self.output_path)
 
         # verbose
         if self.verbose:
@@ -1146,62 +1417,62 @@ class CParser:
 
 
     def print(self):
-        print('CONSTS:')
-        pprint(self.CONSTS, sort_dicts=False)
-        print()
+        # format everything first, then write to stdout at once
+        sections: list[str] = []
 
-        print('TYPE_DECL:')
-        pprint(self.TYPE_DECL, sort_dicts=False)
-        print()
-        
-        print('FUNC_DECL:')
-        pprint(self.FUNC_DECL, sort_dicts=False)
-        print()
-        
-        print('STRUCT_DECL:')
-        pprint(self.STRUCT_DECL, sort_dicts=False)
-        print()
+        for name in [
+            'CONSTS',
+            'TYPE_DECL',
+            'FUNC_DECL',
+            'STRUCT_DECL',
+            'UNION_DECL',
+            'ENUM_DECL',
+            'ARRAY_DECL',
+            'TYPEDEF_STRUCT',
+            'TYPEDEF_UNION',
+            'TYPEDEF_ENUM',
+            'TYPEDEF_FUNC_DECL',
+            'TYPEDEF_PTR_DECL',
+            'TYPEDEF_TYPE_DECL',
+        ]:
+            sections.append(f'{name}:\n{pformat(getattr(self, name), sort_dicts=False)}\n\n')
 
-        print('UNION_DECL:')
-        pprint(self.UNION_DECL, sort_dicts=False)
-        print()
+        sys.stdout.write(''.join(sections))
+        sys.stdout.flush()
 
-        print('ENUM_DECL:')
-        pprint(self.ENUM_DECL, sort_dicts=False)
-        print()
-        
-        print('ARRAY_DECL:')
-        pprint(self.ARRAY_DECL, sort_dicts=False)
-        print()
-        
-        print('TYPEDEF_STRUCT:')
-        pprint(self.TYPEDEF_STRUCT, sort_dicts=False)
-        print()
 
-        print('TYPEDEF_UNION:')
-        pprint(self.TYPEDEF_UNION, sort_dicts=False)
-        print()
+def get_stale_extension_source() -> Optional[str]:
+    # compiled autogen extension (see setup.py) is stale if autogen.py next to it was edited after build
+    if __file__.endswith('.py'):
+        return None
 
-        print('TYPEDEF_ENUM:')
-        pprint(self.TYPEDEF_ENUM, sort_dicts=False)
-        print()
-        
-        print('TYPEDEF_FUNC_DECL:')
-        pprint(self.TYPEDEF_FUNC_DECL, sort_dicts=False)
-        print()
-        
-        print('TYPEDEF_PTR_DECL:')
-        pprint(self.TYPEDEF_PTR_DECL, sort_dicts=False)
-        print()
+    source_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'autogen.py')
 
-        print('TYPEDEF_TYPE_DECL:')
-        pprint(self.TYPEDEF_TYPE_DECL, sort_dicts=False)
-        print()
+    if os.path.exists(source_path) and os.path.getmtime(source_path) > os.path.getmtime(__file__):
+        return source_path
 
+    return None
+
+
+def positive_int(value: str) -> int:
+    n = int(value)
+
+    if n < 1:
+        raise argparse.ArgumentTypeError(f'must be at least 1, got {value}')
+
+    return n
+
+
+def main():
+    # run current source instead of outdated compiled module
+    source_path = get_stale_extension_source()
+
+    if source_path:
+        print(f'warning: {__file__} is older than {source_path}, running source, rebuild with: python setup.py build_ext --inplace', file=sys.stderr)
+        os.execv(sys.executable, [sys.executable, source_path, *sys.argv[1:]])
 
-if __name__ == '__main__':
     # cli arg parser
-    parser = argparse.ArgumentParser(description='Convert .h to .js')
+    parser = argparse.ArgumentParser(prog='autogen.py', description='Convert .h to .js')
     parser.add_argument('-fc', dest='frontend_compiler', default='gcc', help='gcc, clang, tcc')
     parser.add_argument('-bc', dest='backend_compiler', default='gcc', help='gcc, clang, tcc')
     parser.add_argument('-fc-cflags', dest='frontend_cflags', default='', help='Frontend compiler\'s cflags')
@@ -1212,6 +1483,7 @@ if __name__ == '__main__':
     parser.add_argument('-o', dest='output_path', help='output path to translated .js/.so file or whole directory')
     parser.add_argument('-k', dest='keep_going', action='store_true', help='keep translating even on errors')
     parser.add_argument('-v', dest='verbose', action='store_true', help='verbose')
+    parser.add_argument('-j', dest='jobs', type=positive_int, default=None, help='number of headers parsed in parallel, defaults to number of CPUs')
     args = parser.parse_args()
 
     # translate
@@ -1224,6 +1496,17 @@ if __name__ == '__main__':
                        args.input_path,
                        args.output_path,
                        args.keep_going,
-                       args.verbose)
+                       args.verbose,
+                       args.jobs)
     
-    c_parser.translate()
+    try:
+        c_parser.translate()
+    except TranslationError as e:
+        if args.verbose:
+            traceback.print_exc()
+
+        sys.exit(str(e))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+# Optional ahead-of-time compilation of autogen.py into a C extension:
+#
+#   pip install cython
+#   python setup.py build_ext --inplace
+#
+# The compiled module is picked up by `import autogen` in place of autogen.py,
+# which stays as the pure Python fallback.
+#
+# autogen.main() falls back to autogen.py when it is newer than the compiled module.
+import sys
+from setuptools import setup, Extension
+
+try:
+    from Cython.Build import cythonize
+except ImportError:
+    sys.exit('setup.py only compiles autogen.py with Cython, install it first: pip install cython')
+
+
+setup(
+    name='quickjs-cffi',
+    version='0.1.0',
+    ext_modules=cythonize(
+        [Extension('autogen', ['autogen.py'], extra_compile_args=['-O3'])],
+        # annotations in autogen.py are informal, do not enforce them as C types
+        compiler_directives={'language_level': '3', 'annotation_typing': False},
+    ),
+)